@@ -18,14 +18,56 @@ import time
 import random
 import socks
 import socket
-import urllib.request
+import urllib.parse
+import urllib.error
+import http.client
+import ssl
 import html
+import html.parser
+import codecs
 import argparse
+import traceback
+import threading
+import sqlite3
+import asyncio
+import concurrent.futures
 from multiprocessing import Pool
 from bs4 import BeautifulSoup
 
 version = 5.2
 
+# link to the real file on the file hosting site, found on the song's page once the form is submitted
+file_link_re = re.compile(r'http://tempfile.ru/download/.*')
+
+# album infos in an album page, used when the fast parser cannot find them
+album_infos_re = re.compile(r'<h1><a href="/artist/.+?.html" title="(.+?) mp3">'
+                            r'.+?<div class="Name">\n(.+?)<br\s?/>', re.S)
+album_year_re = re.compile(r'<h1><a href="/artist/.+?.html" title=".+? mp3">'
+                           r'.+?<div class="Name">\n.+?<br\s?/>\n<i>(\d+)</i>', re.S)
+
+# charset of a page given in its <meta> tags
+meta_charset_re = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.I)
+
+# run-wide settings which are not given to every function. The processes of the pool engine get them from
+# init_worker(), since modification of global variables do not work correctly under windows with multiprocessing.
+settings = {
+    'pool_size': 4,     # idle keep-alive connections kept by host, in each process
+    'segments': 1,      # number of simultaneous range requests for big files
+    'segment_min_size': 20 * 1024 * 1024,   # size from which files are downloaded in segments
+    'parser': "fast",   # "fast" (PageParser, BeautifulSoup as fallback) or "soup" (BeautifulSoup only)
+    'cache': "",        # sqlite database of resolved songs, see ResolutionCache ("" to disable it)
+    'cache_ttl': 3600,  # seconds during which a resolved file link is reused
+}
+
+# keep-alive connections of this process, see get_http_pool()
+http_pool = None
+
+# resolved songs cache of this process, see get_resolution_cache()
+resolution_cache = None
+
+# set when the user interrupts the program, so that the download threads of the async engine stop
+stop_event = threading.Event()
+
 def script_help(version, script_name):
     description = "Python script to download albums from http://musicmp3spb.org, version %s." % version
     help_string = description + """
@@ -79,6 +121,17 @@ cover1.jpg                                                00.03 of 00.03 MB [100
 It will iterate on all albums of this artist.
 
 
+------------------------------------------------------------------------------------------------------------------
+################## Download engines ##############################################################################
+------------------------------------------------------------------------------------------------------------------
+
+By default ("-e pool"), each simultaneous download is done by its own process. With "-e async", all downloads
+are coroutines in a single process, their blocking steps (page fetches, form submission, file transfer) being
+done by a pool of NB_CONN threads, so you can use a much higher "-n" value. The async engine also limits the
+number of simultaneous file transfers (--max_per_host, default 3) and page fetches (--max_pages_per_host,
+default 6) per host. These two options are ignored by the pool engine.
+
+
 ------------------------------------------------------------------------------------------------------------------
 ################# Command line help ##############################################################################
 ------------------------------------------------------------------------------------------------------------------
@@ -129,33 +182,34 @@ def spinning_wheel():
 
 def dl_status(file_name, dlded_size, real_size):
     status = r'%-50s        %05.2f of %05.2f MB [%3d%%]' % \
-        (file_name, to_MB(dlded_size), to_MB(real_size), dlded_size * 100. / real_size)
+        (os.path.basename(file_name), to_MB(dlded_size), to_MB(real_size), dlded_size * 100. / real_size)
     return status
 
 
-def dl_cover(page_soup, url, debug, socks_proxy, socks_port, timeout):
+def find_covers(page):
+    return [src for src in page.images if re.match('/images/.+jpg', src)]
+
+
+def dl_cover(page, url, album_dir, debug, socks_proxy, socks_port, timeout):
     # download albums' cover(s)
-    image_tags = page_soup.find_all('img')
     image_num = 0
-    for image in image_tags:
-        if not re.match('/images/.+jpg', image['src']):
-            continue
-
+    for image_src in extract(page, find_covers):
         # to get the cover in full size, we have to prepend an "f" to the file name
-        entries = re.split("/", image['src'])
+        entries = re.split("/", image_src)
         entries[-1] = "f" + entries[-1]
-        image['src'] = "/".join(entries)
+        image_src = "/".join(entries)
 
         # prepend base url if necessary
-        if not re.match(r'^http:', image['src']):
-            image['src'] = get_base_url(url, debug) + image['src']
-        if debug: print("image: %s" % image['src'])
+        if not re.match(r'^http:', image_src):
+            image_src = get_base_url(url, debug) + image_src
+        if debug: print("image: %s" % image_src)
 
         image_name = "cover"
         if image_num > 0 :
             image_name = image_name + str(image_num)
 
-        download_file(image['src'], image_name + ".jpg", debug, socks_proxy, socks_port, timeout)
+        download_file(image_src, os.path.join(album_dir, image_name + ".jpg"), 
+                      debug, socks_proxy, socks_port, timeout)
 
         image_num += 1
 
@@ -171,14 +225,257 @@ def get_base_url(url, debug):
     return base_url
 
 
-def open_url(url, socks_proxy, socks_port, timeout, data):
-    if socks_proxy and socks_port:
-        socks.set_default_proxy(socks.SOCKS5, socks_proxy, socks_port)
-        socket.socket = socks.socksocket
+class SocksHTTPConnection(http.client.HTTPConnection):
+    # an HTTP connection which may go through a socks proxy, the proxy is set on this connection only
+    def __init__(self, host, port=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, socks_proxy=None, socks_port=None):
+        super().__init__(host, port, timeout=timeout)
+        self.socks_proxy = socks_proxy
+        self.socks_port = socks_port
+
+    def connect(self):
+        if self.socks_proxy and self.socks_port:
+            self.sock = socks.create_connection((self.host, self.port), self.timeout, proxy_type=socks.SOCKS5,
+                                                proxy_addr=self.socks_proxy, proxy_port=self.socks_port)
+        else:
+            super().connect()
+
+
+class SocksHTTPSConnection(SocksHTTPConnection):
+    default_port = http.client.HTTPS_PORT
+
+    def connect(self):
+        super().connect()
+        self.sock = ssl.create_default_context().wrap_socket(self.sock, server_hostname=self.host)
+
+
+class PooledResponse:
+    # an http.client response which gives its connection back to the pool once closed
+    def __init__(self, pool, key, conn, response, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def readinto(self, b):
+        return self.response.readinto(b)
 
+    def info(self):
+        return self.response.msg
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.response.status
+
+    def close(self):
+        if self.conn is None:
+            return
+        try:
+            # the connection can only be reused once the body has been read, small ones are worth reading
+            length = self.response.length
+            if not self.response.isclosed() and length is not None and length <= 65536:
+                self.response.read()
+        except Exception:
+            pass
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.put(self.key, self.conn)
+        else:
+            self.conn.close()
+        self.response.close()
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HTTPConnectionPool:
+    # idle keep-alive connections of this process (shared by its threads), by scheme, host, port and proxy
+    max_redirects = 10
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def get(self, key, timeout):
+        # returns (connection, reused)
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                conn = conns.pop()
+                conn.timeout = timeout
+                if conn.sock:
+                    conn.sock.settimeout(timeout)
+                return (conn, True)
+        (scheme, host, port, socks_proxy, socks_port) = key
+        conn_class = SocksHTTPSConnection if scheme == "https" else SocksHTTPConnection
+        return (conn_class(host, port, timeout=timeout, socks_proxy=socks_proxy, socks_port=socks_port), False)
+
+    def put(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.size:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+
+    def request(self, url, data, headers, timeout, socks_proxy, socks_port):
+        # same as urllib.request.urlopen(): POST if data is not None, follows redirects and raises
+        # urllib.error.HTTPError for error codes, but keeps the connections alive.
+        for i in range(self.max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            key = (parts.scheme, parts.hostname, parts.port, socks_proxy, socks_port)
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            req_headers = {'User-Agent': 'Python-urllib/%s.%s' % sys.version_info[:2], 'Accept-Encoding': 'identity'}
+            if data is not None:
+                req_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            req_headers.update(headers or {})
+
+            method = "POST" if data is not None else "GET"
+            for attempt in range(2):
+                (conn, reused) = self.get(key, timeout)
+                try:
+                    conn.request(method, path, body=data, headers=req_headers)
+                    response = conn.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                    conn.close()
+                    # the server may have closed an idle connection, then retry once with another one
+                    if not reused or attempt:
+                        raise
+                except socket.gaierror as e:
+                    conn.close()
+                    raise urllib.error.URLError(e)
+                except BaseException:
+                    conn.close()
+                    raise
+
+            u = PooledResponse(self, key, conn, response, url)
+            location = response.getheader('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                u.close()
+                url = urllib.parse.urljoin(url, location)
+                if response.status in (301, 302, 303):
+                    # like browsers (and urllib), a redirected POST becomes a GET
+                    data = None
+                continue
+            if response.status >= 400:
+                u.close()
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.msg, None)
+            return u
+
+        raise urllib.error.HTTPError(url, response.status, "too many redirects", response.msg, None)
+
+
+def get_http_pool():
+    # each process (and so each worker of the pool engine) has its own connections
+    global http_pool
+    if http_pool is None:
+        http_pool = HTTPConnectionPool(settings['pool_size'])
+    return http_pool
+
+
+class ResolutionCache:
+    # song url -> file name, link to the file, size of the complete file and when they were found. The 
+    # database is shared by all processes (sqlite does the locking), the connection by the threads of one.
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS songs (url TEXT PRIMARY KEY, file_name TEXT, "
+                            "song_link TEXT, resolved_at REAL, size INTEGER, completed_at REAL)")
+
+    def get(self, url):
+        # returns (file_name, song_link, resolved_at, size) or None
+        with self.lock:
+            return self.db.execute("SELECT file_name, song_link, resolved_at, size FROM songs WHERE url = ?",
+                                   (url,)).fetchone()
+
+    def put(self, url, file_name, song_link):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO songs (url, file_name, song_link, resolved_at) "
+                            "VALUES (?, ?, ?, ?)", (url, file_name, song_link, time.time()))
+
+    def set_size(self, url, size):
+        with self.lock, self.db:
+            self.db.execute("UPDATE songs SET size = ?, completed_at = ? WHERE url = ?", (size, time.time(), url))
+
+    def invalidate(self, url):
+        # the link did not work, it will be resolved again
+        with self.lock, self.db:
+            self.db.execute("UPDATE songs SET song_link = NULL, size = NULL WHERE url = ?", (url,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def get_resolution_cache():
+    # like the connections, each process has its own access to the cache. Returns None if it is disabled.
+    global resolution_cache
+    if resolution_cache is None and settings['cache']:
+        resolution_cache = ResolutionCache(settings['cache'])
+    return resolution_cache
+
+
+def get_cached_song(url, album_dir, debug):
+    # returns (file_name, song_link) from the cache, song_link being None if the file is already complete,
+    # or None if the song must be resolved
+    cache = get_resolution_cache()
+    entry = cache and cache.get(url)
+    if not entry:
+        return None
+    (file_name, song_link, resolved_at, size) = entry
+    file_path = os.path.join(album_dir, file_name)
+    if size and os.path.exists(file_path) and os.path.getsize(file_path) == size:
+        color_message("%s" % dl_status(file_path, size, size), "lightgreen")
+        return (file_name, None)
+    if song_link and time.time() - resolved_at < settings['cache_ttl']:
+        if debug: print("%s: cached song_link: %s" % (worker_name(), song_link))
+        return (file_name, song_link)
+    return None
+
+
+def cache_song(url, file_name, song_link):
+    cache = get_resolution_cache()
+    if cache:
+        cache.put(url, file_name, song_link)
+
+
+def cache_download(url, ret):
+    # remember the size of a complete file, or forget a link which did not work
+    cache = get_resolution_cache()
+    if not cache:
+        return
+    if ret == -1:
+        cache.invalidate(url)
+    elif ret:
+        cache.set_size(url, ret)
+
+
+def open_url(url, socks_proxy, socks_port, timeout, data, headers=None):
     while True:
+        if stop_event.is_set():
+            return None
         try:
-            u = urllib.request.urlopen(url, data, timeout=timeout)
+            u = get_http_pool().request(url, data, headers, timeout, socks_proxy, socks_port)
             redirect = u.geturl()
             if re.search(r'/404.*', redirect):
                 color_message("** Page not found (404), aborting on url: %s **" % url, "lightred")
@@ -187,7 +484,7 @@ def open_url(url, socks_proxy, socks_port, timeout, data):
             color_message("** Connection problem (%s), reconnecting **" % e.reason, "lightyellow")
             time.sleep(random.randint(2,5))
             continue
-        except (socket.timeout, socket.error, ConnectionError) as e:
+        except (socket.timeout, socket.error, ConnectionError, http.client.HTTPException) as e:
             color_message("** Connection problem (%s), reconnecting **" % str(e), "lightyellow")
             time.sleep(random.randint(2,5))
             continue
@@ -208,46 +505,184 @@ def open_url(url, socks_proxy, socks_port, timeout, data):
         return u
 
 
-def get_page_soup(url, data, debug, socks_proxy, socks_port, timeout):
+class PageInfo:
+    # what we use from an album, artist, song or link page
+    def __init__(self, content):
+        self.content = content
+        self.artist = ""
+        self.album = ""
+        self.year = ""
+        self.links = []     # [href, title, text] of each <a href="...">, title is None if not present
+        self.forms = []     # action of each <form>
+        self.inputs = {}    # value of the first <input> of each name
+        self.images = []    # src of each <img>
+        self.soup_info = None
+
+    def fallback(self):
+        # the same infos found by BeautifulSoup, parsed only the first time they are needed
+        if self.soup_info is None:
+            self.soup_info = parse_page_soup(self.content)
+        return self.soup_info
+
+
+class PageParser(html.parser.HTMLParser):
+    # fills a PageInfo in a single pass while the page is downloaded, without building any tree
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.info = PageInfo("")
+        self.link = None        # the <a> we are in
+        self.in_h1 = False
+        self.album_text = None  # text of the album's "Name" div until its <br>
+        self.after_album = False
+        self.year_text = None   # text of the <i> just after this <br>
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        info = self.info
+        if self.after_album:
+            if tag == "i":
+                self.year_text = ""
+            else:
+                self.after_album = False
+
+        if tag == "a" and attrs.get("href") is not None:
+            self.link = [attrs["href"], attrs.get("title"), ""]
+            info.links.append(self.link)
+            title = attrs.get("title") or ""
+            if (self.in_h1 and not info.artist and re.match(r'/artist/.+?.html', attrs["href"]) 
+                and title.endswith(" mp3")):
+                info.artist = title[:-len(" mp3")]
+        elif tag == "h1":
+            self.in_h1 = True
+        elif tag == "div" and attrs.get("class") == "Name" and info.artist and not info.album:
+            self.album_text = ""
+        elif tag == "br" and self.album_text is not None:
+            info.album = self.album_text.strip()
+            self.album_text = None
+            self.after_album = True
+        elif tag == "form":
+            info.forms.append(attrs.get("action") or "")
+        elif tag == "input" and attrs.get("name") is not None:
+            info.inputs.setdefault(attrs["name"], attrs.get("value"))
+        elif tag == "img" and attrs.get("src") is not None:
+            info.images.append(attrs["src"])
+
+    def handle_endtag(self, tag):
+        if tag == "a":
+            self.link = None
+        elif tag == "h1":
+            self.in_h1 = False
+        elif tag == "i" and self.year_text is not None:
+            if self.year_text.strip().isdigit():
+                self.info.year = self.year_text.strip()
+            self.year_text = None
+            self.after_album = False
+
+    def handle_data(self, data):
+        if self.link is not None:
+            self.link[2] += data
+        if self.album_text is not None:
+            self.album_text += data
+        elif self.year_text is not None:
+            self.year_text += data
+        elif self.after_album and data.strip():
+            self.after_album = False
+
+
+def parse_page_soup(content):
+    # slower but more tolerant than PageParser: BeautifulSoup, and regexes on the whole page for album infos
+    page_soup = BeautifulSoup(content, "html.parser")
+    info = PageInfo(content)
+    info.soup_info = info
+    info.links = [[link['href'], link.get('title'), link.get_text()] for link in page_soup.find_all('a', href=True)]
+    info.forms = [form.get('action') or "" for form in page_soup.find_all('form')]
+    for tag in page_soup.find_all('input', attrs={'name': True}):
+        info.inputs.setdefault(tag['name'], tag.get('value'))
+    info.images = [image['src'] for image in page_soup.find_all('img', src=True)]
+
+    # Beautifulsoup converts "&" to "&amp;" so that it be valid html.
+    # We need to convert them back with html.unescape
+    page_content = str(page_soup)
+    album_infos = album_infos_re.search(html.unescape(page_content))
+    if album_infos:
+        info.artist = album_infos.group(1)
+        info.album = album_infos.group(2)
+    album_infos = album_year_re.search(page_content)
+    if album_infos and album_infos.group(1):
+        info.year = album_infos.group(1)
+    return info
+
+
+def extract(page, find):
+    # find(page) with the infos of the fast parser, or with BeautifulSoup's ones if it found nothing
+    return find(page) or find(page.fallback())
+
+
+def get_page(url, data, debug, socks_proxy, socks_port, timeout):
+    # download a page and return its PageInfo, the page is parsed while it is read
     page = open_url(url, socks_proxy, socks_port, timeout, data=data)
     if not page:
         return None
-    page_soup = BeautifulSoup(page, "html.parser", from_encoding=page.info().get_param('charset'))
-    if debug > 1: print("page_soup: %s" % page_soup)
-    page.close()
-    return page_soup
+    try:
+        chunk = page.read(16384)
+        charset = page.info().get_param('charset')
+        if not charset:
+            meta_charset = meta_charset_re.search(chunk)
+            charset = meta_charset.group(1).decode() if meta_charset else "utf-8"
+        try:
+            decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
 
+        parser = PageParser() if settings['parser'] == "fast" else None
+        texts = []
+        while True:
+            text = decoder.decode(chunk, final=not chunk)
+            texts.append(text)
+            if parser:
+                try:
+                    parser.feed(text)
+                except Exception as e:
+                    if debug: print("** fast parser failed on %s (%s), using BeautifulSoup **" % (url, e), file=sys.stderr)
+                    parser = None
+            if not chunk:
+                break
+            chunk = page.read(16384)
+    finally:
+        page.close()
 
-def prepare_album_dir(page_content, base_path, debug):
-    # get album infos from html page content
+    content = "".join(texts)
+    if debug > 1: print("page: %s" % content)
+    if not parser:
+        return parse_page_soup(content)
+    parser.close()
+    parser.info.content = content
+    return parser.info
+
+
+def prepare_album_dir(page, base_path, debug):
+    # get album infos from the album's page
     artist = ""
     title = ""
     year = ""
 
-    album_infos_re = re.compile('<h1><a href="/artist/.+?.html" title="(.+?) mp3">'
-                                '.+?<div class="Name">\n(.+?)<br\s?/>', re.S)
-    # Beautifulsoup converts "&" to "&amp;" so that it be valid html.
-    # We need to convert them back with html.unescape
-    album_infos = album_infos_re.search(html.unescape(page_content))
+    if not page.artist:
+        page = page.fallback()
 
     print("")
-    if not album_infos:
+    if not page.artist:
         artist = input("Unable to get ARTIST NAME. Please enter here: ")
         title = input("Unable to get ALBUM NAME. Please enter here: ")
     else:
-        artist = album_infos.group(1)
-        title = album_infos.group(2)
+        artist = page.artist
+        title = page.album
    
     print("Artist: %s" % artist)
     print("Album: %s" % title)
 
     # Get the year if it is available
-    album_infos_re = re.compile('<h1><a href="/artist/.+?.html" title=".+? mp3">'
-                                '.+?<div class="Name">\n.+?<br\s?/>\n<i>(\d+)</i>', re.S)
-    album_infos = album_infos_re.search(page_content)
-
-    if album_infos and album_infos.group(1):
-        year = album_infos.group(1)
+    if page.year:
+        year = page.year
         print("Year: %s" % year)
     #else:
     #    year = input("Unable to get ALBUM YEAR. Please enter here (may leave blank): ")
@@ -271,8 +706,91 @@ def sanitize_path(path):
     return path.translate(chars_to_remove)
 
 
+def download_segment(url, fd, start, end, u, write_lock, errors, socks_proxy, socks_port, timeout):
+    # download bytes start to end (included) of url at the same offset of the file fd.
+    # u may be an already opened response for this range.
+    try:
+        if u is None:
+            u = open_url(url, socks_proxy, socks_port, timeout, data=None, headers={'Range': 'bytes=%d-%d' % (start, end)})
+            if not u:
+                errors.append((start, "unable to open url"))
+                return
+        content_range = u.info()['content-range'] or ""
+        if u.getcode() != 206 or not content_range.startswith('bytes %d-' % start):
+            errors.append((start, "unexpected answer to the range request: %s %s" % (u.getcode(), content_range)))
+            u.close()
+            return
+
+        offset = start
+        while offset <= end and not stop_event.is_set():
+            buffer = u.read(min(65536, end + 1 - offset))
+            if not buffer:
+                break
+            if hasattr(os, 'pwrite'):
+                os.pwrite(fd, buffer, offset)
+            else:
+                # no pwrite() under windows
+                with write_lock:
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    os.write(fd, buffer)
+            offset += len(buffer)
+        u.close()
+
+        if offset != end + 1:
+            errors.append((start, "got %d bytes instead of %d" % (offset - start, end + 1 - start)))
+    except Exception as e:
+        errors.append((start, str(e)))
+
+
+def download_segmented(url, file_name, real_size, debug, socks_proxy, socks_port, timeout):
+    # download the file in several byte ranges at the same time, into a preallocated ".part" file which is
+    # renamed once complete. Returns real_size when done, -1 on error, or None if the server does not
+    # support ranges (the caller should then do a normal download).
+    process_id = worker_name()
+    nb_segments = settings['segments']
+    segment_size = -(-real_size // nb_segments)
+    ranges = [(start, min(start + segment_size, real_size) - 1) for start in range(0, real_size, segment_size)]
+
+    # the first range also tells us if the server supports them
+    u = open_url(url, socks_proxy, socks_port, timeout, data=None, headers={'Range': 'bytes=%d-%d' % ranges[0]})
+    if not u:
+        return -1
+    if u.getcode() != 206:
+        u.close()
+        if debug: print("%s: range requests not supported for %s, using a single stream" % (process_id, file_name))
+        return None
+
+    part_name = file_name + ".part"
+    fd = os.open(part_name, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+    errors = []
+    try:
+        os.ftruncate(fd, real_size)
+        write_lock = threading.Lock()
+        threads = []
+        for (start, end) in ranges:
+            thread = threading.Thread(target=download_segment, 
+                                      args=(url, fd, start, end, u if start == 0 else None, write_lock, errors, 
+                                            socks_proxy, socks_port, timeout))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    finally:
+        os.close(fd)
+
+    if errors or stop_event.is_set():
+        for (start, error) in errors:
+            if debug: print("%s: segment at %d of %s failed: %s" % (process_id, start, file_name, error), file=sys.stderr)
+        return -1
+
+    os.replace(part_name, file_name)
+    return real_size
+
+
 def download_file(url, file_name, debug, socks_proxy, socks_port, timeout):
-    process_id = os.getpid()
+    # returns the size of the file once it is complete, -1 if we should retry, or None if the file
+    # was downloaded but we could not check it is complete
+    process_id = worker_name()
     try:
         real_size = -1
         partial_dl = 0
@@ -286,8 +804,7 @@ def download_file(url, file_name, debug, socks_proxy, socks_port, timeout):
             dlded_size = 0
 
     
-        req = urllib.request.Request(url)
-        u = open_url(req, socks_proxy, socks_port, timeout, data=None)
+        u = open_url(url, socks_proxy, socks_port, timeout, data=None)
         if not u:
             return -1
 
@@ -315,12 +832,28 @@ def download_file(url, file_name, debug, socks_proxy, socks_port, timeout):
                     continue
  
 
+        if (dlded_size == 0 and settings['segments'] > 1 and real_size >= settings['segment_min_size']):
+            # big file, download it in several parts at the same time
+            u.close()
+            ret = download_segmented(url, file_name, real_size, debug, socks_proxy, socks_port, timeout)
+            if ret == -1:
+                if not stop_event.is_set():
+                    color_message("%s (segmented download incomplete, retrying)" 
+                                  % dl_status(file_name, 0, real_size), "lightyellow")
+                return -1
+            elif ret:
+                color_message("%s" % dl_status(file_name, real_size, real_size), "lightgreen")
+                return real_size
+            # ranges not supported, start again with a single stream
+            u = open_url(url, socks_proxy, socks_port, timeout, data=None)
+            if not u: return -1
+
         # find where to start the file download (continue or start at beginning)
         if (0 < dlded_size < real_size):
             # file incomplete, we need to resume download
             u.close()
-            req = urllib.request.Request(url, headers={'Range': 'bytes=%s-%s' % (dlded_size, real_size)})
-            u = open_url(req, socks_proxy, socks_port, timeout, data=None)
+            u = open_url(url, socks_proxy, socks_port, timeout, data=None, 
+                         headers={'Range': 'bytes=%s-%s' % (dlded_size, real_size)})
             if not u: return -1
     
             # test if the server supports the Range header
@@ -334,7 +867,7 @@ def download_file(url, file_name, debug, socks_proxy, socks_port, timeout):
             # file already completed, skipped
             color_message("%s" % dl_status(file_name, dlded_size, real_size), "lightgreen")
             u.close()
-            return
+            return real_size
         elif (dlded_size > real_size):
             # we got a problem, restart download
             color_message("** The real size of %s could not be found or an other problem occured, retrying **" % file_name, "lightyellow")
@@ -351,7 +884,7 @@ def download_file(url, file_name, debug, socks_proxy, socks_port, timeout):
         # get the file
         block_sz = 8192
         #spin = spinning_wheel()
-        while True:
+        while not stop_event.is_set():
             buffer = u.read(block_sz)
             if not buffer:
                 break
@@ -365,10 +898,15 @@ def download_file(url, file_name, debug, socks_proxy, socks_port, timeout):
             #time.sleep(0.1)
             #sys.stdout.write('\b')
     
+        if stop_event.is_set():
+            # interrupted, the file is incomplete
+            u.close()
+            f.close()
+            return -1
+
         if (real_size == -1): 
-            real_size = dlded_size
             color_message("%s (file downloaded, but could not verify if it is complete)" 
-                   % dl_status(file_name, dlded_size, real_size), "lightyellow")
+                   % dl_status(file_name, dlded_size, dlded_size), "lightyellow")
         elif (real_size == dlded_size):
             color_message("%s" # file downloaded and complete
                    % dl_status(file_name, dlded_size, real_size), "lightgreen")
@@ -382,74 +920,154 @@ def download_file(url, file_name, debug, socks_proxy, socks_port, timeout):
         #sys.stdout.write('\n')
         u.close()
         f.close()
+        if (real_size == dlded_size):
+            return real_size
     except KeyboardInterrupt as e:
         if debug: print("** %s : download_file: keyboard interrupt detected **" % process_id, file=sys.stderr)
         raise e
     except Exception as e:
         color_message('** Exception caught in download_file(%s,%s) with error: "%s". We will continue anyway. **' 
                % (url, file_name, str(e)), "lightyellow")
-        traceback.print_stack(file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
         pass
 
 
+def init_worker(worker_settings):
+    settings.update(worker_settings)
+
+
+def worker_name():
+    # the pool engine has one process per download, the async engine one thread per download
+    if threading.current_thread() is threading.main_thread():
+        return str(os.getpid())
+    return "%s/%s" % (os.getpid(), threading.current_thread().name)
+
+
+def get_song_page(url, debug, socks_proxy, socks_port, timeout):
+    # get the file name and the hidden form value from a song's page.
+    # returns (file_name, submit_value) or -1 if we should retry
+    process_id = worker_name()
+    if debug: print("%s: downloading song from %s" % (process_id, url))
+
+    page = get_page(url, str.encode(''), debug, socks_proxy, socks_port, timeout)
+    if not page:
+        if debug: print("** %s: Unable to get song's page, retrying **" % process_id, file=sys.stderr)
+        return -1
+
+    ret = extract(page, find_song_form)
+    if not ret:
+        color_message("** %s: Cannot find filename for: %s , retrying **" % (process_id, url), "lightyellow")
+        return -1
+    (file_name, submit_value) = ret
+    if debug: print("%s: got_filename: %s" % (process_id, file_name))
+    if debug: print("%s: submit_value: %s" % (process_id, submit_value))
+
+    return (file_name, submit_value)
+
+
+def find_song_form(page):
+    # the file name is the text of the link to the form's action
+    for action in page.forms:
+        if re.match(r'/file/.*', action):
+            break
+    else:
+        return None
+
+    file_name = ""
+    for (href, title, text) in page.links:
+        if href.startswith(action):
+            file_name = text
+            break
+
+    # we need to re-submit the same page with an hidden input value to get the real link
+    submit_value = page.inputs.get('robot_code')
+    if not file_name or submit_value is None:
+        return None
+    return (file_name, submit_value)
+
+
+def submit_song_form(url, file_name, debug, socks_proxy, socks_port, timeout):
+    # find where the song's form has to be submitted, returns None if the song must be skipped
+    response = open_url(url, socks_proxy, socks_port, timeout, data=None)
+    if not response:
+        color_message("** %s: Error: Unable to submit form for %s, skipping song **" 
+                      % (worker_name(), file_name), "lightred")
+        return None
+    real_link = response.geturl()
+    response.close()
+    return real_link
+
+
+def get_song_link(real_link, file_name, submit_value, debug, socks_proxy, socks_port, timeout):
+    # submit the song's form to get the link to the file.
+    # returns the link, -1 if we should retry, or None if the song must be skipped
+    process_id = worker_name()
+    data = urllib.parse.urlencode([('robot_code', submit_value)])
+
+    response = get_page(real_link, str.encode(data), debug, socks_proxy, socks_port, timeout)
+    if not response:
+        color_message("** %s: Error: Unable to get song's page (2), skipping song **" % process_id, "lightred")
+        return None
+
+    song_link = extract(response, find_file_link)
+    if song_link:
+        if debug: print("%s: song_link: %s" % (process_id, song_link))
+    else:
+        color_message("** %s: Cannot find song's real link for: %s, retrying **" % (process_id, file_name), "lightyellow")
+        if debug > 1: print("** %s: response %s" % (process_id, response.content))
+        return -1
+
+    return song_link
+
+
+def find_file_link(page):
+    for (href, title, text) in page.links:
+        if file_link_re.match(href):
+            return href
+    return None
+
+
+def resolve_song(url, debug, socks_proxy, socks_port, timeout):
+    # get the file name and the real link of a song from its page.
+    # returns (file_name, song_link), -1 if we should retry, or None if the song must be skipped
+    ret = get_song_page(url, debug, socks_proxy, socks_port, timeout)
+    if ret == -1:
+        return -1
+    (file_name, submit_value) = ret
+
+    real_link = submit_song_form(url, file_name, debug, socks_proxy, socks_port, timeout)
+    if not real_link:
+        return None
+
+    song_link = get_song_link(real_link, file_name, submit_value, debug, socks_proxy, socks_port, timeout)
+    if song_link == -1 or not song_link:
+        return song_link
+
+    return (file_name, song_link)
+
+
 def download_song(params):
-    (url, debug, socks_proxy, socks_port, timeout) = params
-    process_id = os.getpid()
+    (url, album_dir, debug, socks_proxy, socks_port, timeout) = params
+    process_id = worker_name()
 
-    while True: # continue until we have the song
+    while not stop_event.is_set(): # continue until we have the song
         try:
-            if debug: print("%s: downloading song from %s" % (process_id, url))
             file_name = ""
-        
-            page_soup = get_page_soup(url, str.encode(''), debug, socks_proxy, socks_port, timeout)
-            if not page_soup: 
-                if debug: print("** %s: Unable to get song's page soup, retrying **" % process_id, file=sys.stderr)
-                continue
-        
-            # get the filename
-            for form in page_soup.find_all('form'):
-                if re.match(r'/file/.*', form.attrs['action']):
-                    break
-            if debug > 1: print("form_attr: " + form.attrs['action'])
-        
-            for link in page_soup.find_all('a', href=True):
-                if re.match(form.attrs['action'], link['href']):
-                    file_name = link.contents[0]
-                    break
-            if file_name != "":
-                if debug: print("%s: got_filename: %s" % (process_id, file_name))
-            else:
-                color_message("** %s: Cannot find filename for: %s , retrying **" % (process_id, link['href']), "lightyellow")
-                continue
-        
-            # we need to re-submit the same page with an hidden input value to get the real link
-            submit_value = page_soup.find('input', {'name': 'robot_code'}).get('value')
-            if debug: print("%s: submit_value: %s" % (process_id, submit_value))
-        
-            data = urllib.parse.urlencode([('robot_code', submit_value)])
-        
-            response = open_url(url, socks_proxy, socks_port, timeout, data=None)
-            if not response:
-                color_message("** %s: Error: Unable to submit form for %s, skipping song **" % (process_id, file_name), "lightred")
-                return
-            real_link = response.geturl()
-            response.close()
-            response_soup = get_page_soup(real_link, str.encode(data), debug, socks_proxy, socks_port, timeout)
-            if not response_soup:
-                color_message("** %s: Error: Unable to get song's page soup (2), skipping song **" % process_id, "lightred")
+            ret = get_cached_song(url, album_dir, debug)
+            if not ret:
+                ret = resolve_song(url, debug, socks_proxy, socks_port, timeout)
+                if ret == -1:
+                    continue
+                elif not ret:
+                    return
+                cache_song(url, *ret)
+            (file_name, song_link) = ret
+            if not song_link:
+                # already complete
                 return
-        
-            for song_link in response_soup.find_all('a', href=True):
-                if re.match(r'http://tempfile.ru/download/.*', song_link['href']):
-                    break
-            if song_link['href'] != "" and song_link['href'] != "/":
-                if debug: print("%s: song_link: %s" % (process_id, song_link['href']))
-            else:
-                color_message("** %s: Cannot find song's real link for: %s, retrying **" % (process_id, file_name), "lightyellow")
-                if debug > 1: print("** %s: response_soup %s" % (process_id, response_soup))
-                continue
-        
-            ret = download_file(song_link['href'], file_name, debug, socks_proxy, socks_port, timeout)
+
+            ret = download_file(song_link, os.path.join(album_dir, file_name), debug, socks_proxy, socks_port, timeout)
+            cache_download(url, ret)
             if ret == -1:
                 color_message("** %s: Problem detected while downloading %s, retrying **" % (process_id, file_name), "lightyellow")
                 continue
@@ -463,78 +1081,227 @@ def download_song(params):
         except Exception as e:
             color_message('** %s: Exception caught in download_song(%s,%s) with error: "%s", retrying **'
                    % (process_id, url, file_name, str(e)), "lightyellow")
-            traceback.print_stack(file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
             pass
 
 
+def get_host(url):
+    return urllib.parse.urlsplit(url).hostname or ""
+
+
+def get_host_sem(host_sems, url, max_per_host):
+    # one asyncio semaphore per host, created on first use
+    host = get_host(url)
+    if host not in host_sems:
+        host_sems[host] = asyncio.Semaphore(max_per_host)
+    return host_sems[host]
+
+
+async def download_song_async(url, album_dir, debug, socks_proxy, socks_port, timeout, executor, page_sems, max_pages_per_host, 
+                              file_sems, max_per_host):
+    # same as download_song(), but each blocking step is run in the executor's threads. Page fetches and 
+    # file transfers are throttled by separate per-host semaphores, a semaphore is only held during one step.
+    loop = asyncio.get_running_loop()
+    task_name = "task-%x" % id(asyncio.current_task())
+
+    while not stop_event.is_set(): # continue until we have the song
+        try:
+            file_name = ""
+            ret = await loop.run_in_executor(executor, get_cached_song, url, album_dir, debug)
+            if ret:
+                (file_name, song_link) = ret
+                if not song_link:
+                    # already complete
+                    return
+            else:
+                async with get_host_sem(page_sems, url, max_pages_per_host):
+                    ret = await loop.run_in_executor(executor, get_song_page, 
+                                                     url, debug, socks_proxy, socks_port, timeout)
+                if ret == -1:
+                    continue
+                (file_name, submit_value) = ret
+
+                async with get_host_sem(page_sems, url, max_pages_per_host):
+                    real_link = await loop.run_in_executor(executor, submit_song_form, 
+                                                           url, file_name, debug, socks_proxy, socks_port, timeout)
+                if not real_link:
+                    return
+
+                async with get_host_sem(page_sems, real_link, max_pages_per_host):
+                    song_link = await loop.run_in_executor(executor, get_song_link, real_link, file_name, submit_value,
+                                                           debug, socks_proxy, socks_port, timeout)
+                if song_link == -1:
+                    continue
+                elif not song_link:
+                    return
+                await loop.run_in_executor(executor, cache_song, url, file_name, song_link)
+
+            async with get_host_sem(file_sems, song_link, max_per_host):
+                ret = await loop.run_in_executor(executor, download_file, song_link, os.path.join(album_dir, file_name),
+                                                 debug, socks_proxy, socks_port, timeout)
+            await loop.run_in_executor(executor, cache_download, url, ret)
+            if ret == -1:
+                if not stop_event.is_set():
+                    color_message("** %s: Problem detected while downloading %s, retrying **" 
+                                  % (task_name, file_name), "lightyellow")
+                continue
+            else:
+                break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            color_message('** %s: Exception caught in download_song_async(%s,%s) with error: "%s", retrying **'
+                   % (task_name, url, file_name, str(e)), "lightyellow")
+            traceback.print_exc(file=sys.stderr)
+
+
+async def download_songs_async(songs_jobs, debug, socks_proxy, socks_port, timeout, nb_conn, 
+                               max_pages_per_host, max_per_host):
+    # all songs are coroutines in this process, but the blocking urllib calls are done in a pool of nb_conn
+    # threads: nb_conn is the global number of requests in flight, it can be much higher than with the
+    # pool engine since threads are cheap.
+    loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=nb_conn, thread_name_prefix="dl")
+    page_sems = {}
+    file_sems = {}
+    tasks = []
+    try:
+        # the jobs may come from a generator which fetches album pages and covers, it is run in the loop's
+        # default executor so that the songs already known are downloaded meanwhile.
+        songs_jobs = iter(songs_jobs)
+        while not stop_event.is_set():
+            job = await loop.run_in_executor(None, next, songs_jobs, None)
+            if job is None:
+                break
+            (url, album_dir) = job
+            tasks.append(asyncio.ensure_future(download_song_async(url, album_dir, debug, socks_proxy, socks_port, 
+                                                                   timeout, executor, page_sems, max_pages_per_host,
+                                                                   file_sems, max_per_host)))
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # when interrupted, don't wait for the threads, they will notice stop_event soon enough
+        executor.shutdown(wait=not stop_event.is_set())
+
+
+def download_songs(songs_jobs, debug, socks_proxy, socks_port, timeout, nb_conn, engine, max_per_host,
+                   max_pages_per_host):
+    # download all songs given by the songs_jobs iterable of (song_url, album_dir), which is consumed lazily
+    if engine == "async":
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        task = loop.create_task(download_songs_async(songs_jobs, debug, socks_proxy, socks_port, timeout,
+                                                     nb_conn, max_pages_per_host, max_per_host))
+        try:
+            loop.run_until_complete(task)
+        except KeyboardInterrupt as e:
+            color_message("** Program interrupted by user, exiting! **", "lightred")
+            # tell the threads still working to give up, and let the coroutines be cancelled properly
+            stop_event.set()
+            task.cancel()
+            try:
+                loop.run_until_complete(task)
+            except (asyncio.CancelledError, KeyboardInterrupt):
+                pass
+            sys.exit(1)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        return
+
+    # we launch the processes to do the downloads
+    pool = Pool(processes=nb_conn, initializer=init_worker, initargs=(settings,))
+
+    # imap_unordered accepts only one argument for the function call, so me must aggregate all in one.
+    # the pool consumes the jobs in a thread of its own, so the album pages and covers are fetched
+    # while the workers download the songs already queued.
+    params = ((url, album_dir, debug, socks_proxy, socks_port, timeout) for (url, album_dir) in songs_jobs)
+    try:
+        for ret in pool.imap_unordered(download_song, params):
+            pass
+        pool.close()
+        pool.join()
+    except KeyboardInterrupt as e:
+        color_message("** Program interrupted by user, exiting! **", "lightred")
+        stop_event.set()
+        pool.terminate()
+        pool.join()
+        sys.exit(1)
+
 
-def download_album(url, base_path, debug, socks_proxy, socks_port, timeout, nb_conn):
-    page_soup = get_page_soup(url, str.encode(''), debug, socks_proxy, socks_port, timeout)
-    if not page_soup:
-        if debug: print("** Unable to get album's page soup **", file=sys.stderr)
+def album_songs(url, base_path, debug, socks_proxy, socks_port, timeout):
+    # prepare the album's directory, download its covers and yield (song_url, album_dir) for each of its songs
+    page = get_page(url, str.encode(''), debug, socks_proxy, socks_port, timeout)
+    if not page:
+        if debug: print("** Unable to get album's page **", file=sys.stderr)
         return
-    page_content = str(page_soup)
-    if debug > 1: print(page_content)
 
-    album_dir = prepare_album_dir(page_content, base_path, debug)
+    album_dir = prepare_album_dir(page, base_path, debug)
 
-    os.chdir(album_dir)
- 
-    dl_cover(page_soup, url, debug, socks_proxy, socks_port, timeout)
+    dl_cover(page, url, album_dir, debug, socks_proxy, socks_port, timeout)
 
     # create list of album's songs
-    songs_links = []
-    title_regexp = re.compile('.*Скачать mp3.*', re.IGNORECASE)
-    for link in page_soup.find_all('a', href=True, title=True):
-        if not re.match('/download/.*', link['href']):
-            continue
-
-        if title_regexp.match(link['title']):
-            # prepend base url if necessary
-            if re.match(r'^/', link['href']):
-                link['href'] = get_base_url(url, debug) + link['href']
-            songs_links.append(link['href'])
+    songs_links = extract(page, find_songs_links)
 
     if not songs_links:
         color_message("** Unable to detect any song links, skipping this album/url **", "lightred")
-    else:
-        # we launch the threads to do the downloads
-        pool = Pool(processes=nb_conn)
 
-        # pool.map accepts only one argument for the function call, so me must aggregate all in one
-        params = [(url, debug, socks_proxy, socks_port, timeout) for url in songs_links]
-        try:
-            pool.map(download_song, params)
-            pool.close()
-            pool.join()
-        except KeyboardInterrupt as e:
-            color_message("** Program interrupted by user, exiting! **", "lightred")
-            pool.terminate()
-            pool.join()
-            sys.exit(1)
+    for song_link in songs_links:
+        # prepend base url if necessary
+        if re.match(r'^/', song_link):
+            song_link = get_base_url(url, debug) + song_link
+        yield (song_link, album_dir)
+
+
+def find_songs_links(page):
+    title_regexp = re.compile('.*Скачать mp3.*', re.IGNORECASE)
+    return [href for (href, title, text) in page.links
+            if re.match('/download/.*', href) and title is not None and title_regexp.match(title)]
 
-    os.chdir('..')
+
+def download_album(url, base_path, debug, socks_proxy, socks_port, timeout, nb_conn, engine, max_per_host,
+                   max_pages_per_host):
+    download_songs(album_songs(url, base_path, debug, socks_proxy, socks_port, timeout),
+                   debug, socks_proxy, socks_port, timeout, nb_conn, engine, max_per_host, max_pages_per_host)
     print("ALBUM DOWNLOAD FINISHED")
 
 
-def download_artist(url, base_path, debug, socks_proxy, socks_port, timeout, nb_conn):
-    page_soup = get_page_soup(url, str.encode(''), debug, socks_proxy, socks_port, timeout)
-    if not page_soup:
-        if debug: print("** Unable to get artist's page soup **", file=sys.stderr)
+def artist_songs(url, base_path, debug, socks_proxy, socks_port, timeout):
+    # yield (song_url, album_dir) for all songs of all albums of an artist
+    page = get_page(url, str.encode(''), debug, socks_proxy, socks_port, timeout)
+    if not page:
+        if debug: print("** Unable to get artist's page **", file=sys.stderr)
         return 
 
     color_message("** Warning: we are going to download all albums from this artist! **", "lightyellow")
 
+    for album_link in extract(page, find_albums_links):
+        if stop_event.is_set():
+            return
+        try:
+            yield from album_songs(get_base_url(url, debug) + album_link, base_path, 
+                                   debug, socks_proxy, socks_port, timeout)
+        except Exception as e:
+            color_message("** Error: Cannot get album: %s, reason: %s **" % (album_link, str(e)), "lightred")
+            traceback.print_exc(file=sys.stderr)
+
+
+def find_albums_links(page):
     albums_links = []
-    for link in page_soup.find_all('a', href=True):
-        if re.match(r'/album/.*', link['href']):
+    for (href, title, text) in page.links:
+        if re.match(r'/album/.*', href):
             # most of album's links appear 2 times, we need to de-duplicate.
-            if link['href'] not in albums_links:
-                albums_links.append(link['href'])
+            if href not in albums_links:
+                albums_links.append(href)
+    return albums_links
+
 
-    for album_link in albums_links:
-            download_album(get_base_url(url, debug) + album_link, base_path, 
-                           debug, socks_proxy, socks_port, timeout, nb_conn)
+def download_artist(url, base_path, debug, socks_proxy, socks_port, timeout, nb_conn, engine, max_per_host,
+                    max_pages_per_host):
+    # all songs of all albums go in the same queue, so that no connection is idle between two albums
+    download_songs(artist_songs(url, base_path, debug, socks_proxy, socks_port, timeout),
+                   debug, socks_proxy, socks_port, timeout, nb_conn, engine, max_per_host, max_pages_per_host)
     print("")
     print("ARTIST DOWNLOAD FINISHED")
  
@@ -546,6 +1313,9 @@ def main():
     socks_port = ""
     timeout = 10
     nb_conn = 3
+    engine = "pool"
+    max_per_host = 3
+    max_pages_per_host = 6
     script_name = os.path.basename(sys.argv[0])
 
     parser = argparse.ArgumentParser(description=script_help(version, script_name), add_help=True, 
@@ -559,6 +1329,38 @@ def main():
         "-t", "--timeout", type=int, default=10, help='Timeout for HTTP connections in seconds')
     parser.add_argument(
         "-n", "--nb_conn", type=int, default=3, help='Number of simultaneous downloads (max 3 for tempfile.ru)')
+    parser.add_argument(
+        "-e", "--engine", type=str, choices=["pool", "async"], default="pool", 
+        help='Download engine: "pool" uses one process per download, "async" runs all downloads\n'
+             'as coroutines in a single process, their blocking steps being done by a pool of\n'
+             'NB_CONN threads (so NB_CONN can be much higher)')
+    parser.add_argument(
+        "--max_per_host", type=int, default=None, help='Maximum number of simultaneous file transfers from the same\n'
+                                                       'host (async engine only, default 3, max 3 for tempfile.ru)')
+    parser.add_argument(
+        "--max_pages_per_host", type=int, default=None, help='Maximum number of simultaneous page fetches from the\n'
+                                                             'same host (async engine only, default 6)')
+    parser.add_argument(
+        "--pool_size", type=int, default=4, help='Number of idle keep-alive connections kept for each host by each\n'
+                                                 'process (0 to disable keep-alive)')
+    parser.add_argument(
+        "--segments", type=int, default=1, help='Download files bigger than SEGMENT_MIN_SIZE with this number of\n'
+                                                'simultaneous range requests (each one is a connection to the file host)')
+    parser.add_argument(
+        "--segment_min_size", type=float, default=20, help='Minimum size in MB of the files downloaded in segments\n'
+                                                           '(default 20)')
+    parser.add_argument(
+        "--parser", type=str, choices=["fast", "soup"], default="fast",
+        help='HTML parser: "fast" extracts what we need while the pages are read, with BeautifulSoup\n'
+             'as a fallback, "soup" always uses BeautifulSoup (slower)')
+    parser.add_argument(
+        "--cache", type=str, default=None, help='File of the cache of resolved songs (file names, links and sizes),\n'
+                                                'defaults to ".musicmp3spb-cache.sqlite" in PATH. Complete songs found\n'
+                                                'in it are skipped without fetching their pages')
+    parser.add_argument(
+        "--cache_ttl", type=float, default=60, help='Minutes during which a cached link to a file is reused (default 60)')
+    parser.add_argument(
+        "--no_cache", action='store_true', help='Do not use the cache of resolved songs')
     parser.add_argument(
         "-p", "--path", type=str, default=".", help="Base directory in which album(s) will be"
                                                     " downloaded. Defaults to current directory.")
@@ -573,6 +1375,21 @@ def main():
 
     nb_conn = int(args.nb_conn)
     timeout = int(args.timeout)
+    engine = args.engine
+    settings['pool_size'] = int(args.pool_size)
+    settings['segments'] = max(1, int(args.segments))
+    settings['segment_min_size'] = int(args.segment_min_size * 1024 * 1024)
+    settings['parser'] = args.parser
+    if not args.no_cache:
+        settings['cache'] = args.cache or os.path.join(args.path, ".musicmp3spb-cache.sqlite")
+    settings['cache_ttl'] = args.cache_ttl * 60
+    if engine == "pool" and (args.max_per_host or args.max_pages_per_host):
+        color_message("** Warning: --max_per_host and --max_pages_per_host are ignored by the pool engine **",
+                      "lightyellow")
+    if args.max_per_host:
+        max_per_host = int(args.max_per_host)
+    if args.max_pages_per_host:
+        max_pages_per_host = int(args.max_pages_per_host)
 
     if (args.socks):
         (socks_proxy, socks_port) = args.socks.split(':')
@@ -589,15 +1406,17 @@ def main():
         # modification of global variables do not work correctly under windows with multiprocessing,
         # so I have to pass all these parameters to these functions...
         if re.search(r'/artist/.*', args.url):
-            download_artist(args.url, args.path, debug, socks_proxy, socks_port, timeout, nb_conn)
+            download_artist(args.url, args.path, debug, socks_proxy, socks_port, timeout, nb_conn, 
+                            engine, max_per_host, max_pages_per_host)
         elif re.search(r'/album/.*', args.url):
-            download_album(args.url, args.path, debug, socks_proxy, socks_port, timeout, nb_conn)
+            download_album(args.url, args.path, debug, socks_proxy, socks_port, timeout, nb_conn,
+                           engine, max_per_host, max_pages_per_host)
         else:
             color_message("** Error: unable to recognize url, it should contain '/artist/' or '/album/'! **", "lightred")
 
     except Exception as e:
         color_message("** Error: Cannot download URL: %s, reason: %s **" % (args.url, str(e)), "lightred")
-        traceback.print_stack(file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
 
 if __name__ == "__main__":
     main()
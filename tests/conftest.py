@@ -0,0 +1,23 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "musicmp3spb-3.py")
+
+
+def load_script():
+    # the script's name is not a valid module name, so load it by path
+    spec = importlib.util.spec_from_file_location("musicmp3spb", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["musicmp3spb"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def mp3spb():
+    module = load_script()
+    yield module
+    module.stop_event.clear()
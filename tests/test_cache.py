@@ -0,0 +1,86 @@
+import os
+import time
+
+import pytest
+
+
+class Network:
+    # stubs resolve_song() and download_file(), counting their calls
+    def __init__(self, mp3spb, monkeypatch, fail=()):
+        self.resolved = []
+        self.downloaded = []
+        self.fail = set(fail)
+        monkeypatch.setattr(mp3spb, "resolve_song", self.resolve_song)
+        monkeypatch.setattr(mp3spb, "download_file", self.download_file)
+        monkeypatch.setattr(mp3spb, "color_message", lambda msg, color: None)
+
+    def resolve_song(self, url, *args):
+        self.resolved.append(url)
+        name = url.rsplit("/", 1)[-1].replace(".html", ".mp3")
+        return (name, "http://tempfile.ru/download/%d/%s" % (len(self.resolved), name))
+
+    def download_file(self, song_link, file_path, *args):
+        self.downloaded.append(song_link)
+        if song_link in self.fail:
+            self.fail.remove(song_link)
+            return -1
+        with open(file_path, "wb") as f:
+            f.write(b"x" * 10000)
+        return 10000
+
+
+@pytest.fixture
+def cached(mp3spb, tmp_path):
+    mp3spb.settings["cache"] = str(tmp_path / "cache.sqlite")
+    yield mp3spb
+    if mp3spb.resolution_cache:
+        mp3spb.resolution_cache.close()
+
+
+def download(mp3spb, url, album_dir, engine):
+    if engine == "pool":
+        # what each process of the pool engine does, run in this process so that the stubs are used
+        mp3spb.download_song((url, album_dir, 0, "", "", 10))
+    else:
+        mp3spb.download_songs([(url, album_dir)], 0, "", "", 10, 2, engine, 3, 3)
+
+
+@pytest.mark.parametrize("engine", ["async", "pool"])
+def test_complete_songs_are_not_resolved_again(cached, monkeypatch, tmp_path, engine):
+    network = Network(cached, monkeypatch)
+    url = "http://musicmp3spb.org/download/song.html"
+
+    download(cached, url, str(tmp_path), engine)
+    download(cached, url, str(tmp_path), engine)
+    assert network.resolved == [url]
+    assert network.downloaded == ["http://tempfile.ru/download/1/song.mp3"]
+
+    # the file is gone, the cached link is used again
+    os.remove(str(tmp_path / "song.mp3"))
+    download(cached, url, str(tmp_path), engine)
+    assert network.resolved == [url]
+    assert network.downloaded == ["http://tempfile.ru/download/1/song.mp3"] * 2
+
+
+def test_failed_links_are_resolved_again(cached, monkeypatch, tmp_path):
+    network = Network(cached, monkeypatch, fail=["http://tempfile.ru/download/1/song.mp3"])
+    url = "http://musicmp3spb.org/download/song.html"
+
+    download(cached, url, str(tmp_path), "async")
+    assert network.resolved == [url, url]
+    assert network.downloaded == ["http://tempfile.ru/download/1/song.mp3", "http://tempfile.ru/download/2/song.mp3"]
+    (file_name, song_link, resolved_at, size) = cached.resolution_cache.get(url)
+    assert (file_name, song_link, size) == ("song.mp3", "http://tempfile.ru/download/2/song.mp3", 10000)
+
+
+def test_expired_links_are_resolved_again(cached, monkeypatch, tmp_path):
+    network = Network(cached, monkeypatch)
+    url = "http://musicmp3spb.org/download/song.html"
+    cache = cached.get_resolution_cache()
+    cache.put(url, "song.mp3", "http://tempfile.ru/download/old/song.mp3")
+    cached.settings["cache_ttl"] = 0
+    time.sleep(0.01)
+
+    download(cached, url, str(tmp_path), "async")
+    assert network.resolved == [url]
+    assert network.downloaded == ["http://tempfile.ru/download/1/song.mp3"]
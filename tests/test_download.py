@@ -0,0 +1,85 @@
+import http.server
+import os
+import re
+import threading
+
+import pytest
+
+CONTENT = bytes(range(256)) * 4096    # 1 MB
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    accept_ranges = True
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        range_header = self.headers["Range"]
+        self.requests.append(range_header)
+        match = re.match(r"bytes=(\d+)-(\d*)", range_header or "")
+        if self.accept_ranges and match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(CONTENT) - 1), len(CONTENT) - 1)
+            body = CONTENT[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, len(CONTENT)))
+        else:
+            body = CONTENT
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def file_server():
+    FileHandler.requests = []
+    FileHandler.accept_ranges = True
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d/song.mp3" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def segmented(mp3spb, monkeypatch):
+    monkeypatch.setattr(mp3spb, "color_message", lambda msg, color: None)
+    mp3spb.settings.update(segments=4, segment_min_size=100000)
+    return mp3spb
+
+
+def test_segmented_download(segmented, file_server, tmp_path):
+    file_name = str(tmp_path / "song.mp3")
+    assert segmented.download_file(file_server, file_name, 0, "", "", 5) == len(CONTENT)
+
+    with open(file_name, "rb") as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(file_name + ".part")
+    assert sorted(r for r in FileHandler.requests if r) == \
+        ["bytes=0-262143", "bytes=262144-524287", "bytes=524288-786431", "bytes=786432-1048575"]
+
+
+def test_segmented_download_without_ranges(segmented, file_server, tmp_path):
+    # the server ignores the Range header, the file is downloaded in a single stream
+    FileHandler.accept_ranges = False
+    file_name = str(tmp_path / "song.mp3")
+    assert segmented.download_file(file_server, file_name, 0, "", "", 5) == len(CONTENT)
+
+    with open(file_name, "rb") as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(file_name + ".part")
+
+
+def test_small_files_are_not_segmented(segmented, file_server, tmp_path):
+    segmented.settings["segment_min_size"] = 2 * len(CONTENT)
+    file_name = str(tmp_path / "song.mp3")
+    assert segmented.download_file(file_server, file_name, 0, "", "", 5) == len(CONTENT)
+
+    with open(file_name, "rb") as f:
+        assert f.read() == CONTENT
+    assert FileHandler.requests == [None]
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+
+class Counter:
+    # keeps track of the peak number of simultaneous calls, globally and per key
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = {}
+        self.peak = {}
+        self.done = []
+
+    def enter(self, key):
+        with self.lock:
+            for k in (key, "all"):
+                self.current[k] = self.current.get(k, 0) + 1
+                self.peak[k] = max(self.peak.get(k, 0), self.current[k])
+
+    def leave(self, key):
+        with self.lock:
+            for k in (key, "all"):
+                self.current[k] -= 1
+
+
+def stub_network(mp3spb, monkeypatch, counter, fail_once=()):
+    failed = set()
+
+    def get_song_page(url, *args):
+        counter.enter("page")
+        time.sleep(0.01)
+        counter.leave("page")
+        return (url.rsplit("/", 1)[-1], "code")
+
+    def submit_song_form(url, file_name, *args):
+        return url
+
+    def get_song_link(real_link, file_name, *args):
+        return "http://tempfile.ru/download/" + file_name
+
+    def download_file(url, file_path, *args):
+        file_name = os.path.basename(file_path)
+        counter.enter("file")
+        time.sleep(0.05)
+        counter.leave("file")
+        if file_name in fail_once and file_name not in failed:
+            failed.add(file_name)
+            return -1
+        counter.done.append(file_name)
+
+    monkeypatch.setattr(mp3spb, "get_song_page", get_song_page)
+    monkeypatch.setattr(mp3spb, "submit_song_form", submit_song_form)
+    monkeypatch.setattr(mp3spb, "get_song_link", get_song_link)
+    monkeypatch.setattr(mp3spb, "download_file", download_file)
+    monkeypatch.setattr(mp3spb, "color_message", lambda msg, color: None)
+
+
+def songs(n):
+    return [("http://musicmp3spb.org/download/%d.html" % i, "album") for i in range(n)]
+
+
+def test_async_engine_limits(mp3spb, monkeypatch):
+    counter = Counter()
+    stub_network(mp3spb, monkeypatch, counter)
+    mp3spb.download_songs(songs(20), 0, "", "", 10, 8, "async", 3, 5)
+
+    assert counter.peak["file"] == 3
+    assert counter.peak["page"] <= 5
+    assert counter.peak["all"] <= 8
+    assert sorted(counter.done) == sorted(url.rsplit("/", 1)[-1] for (url, album_dir) in songs(20))
+
+
+def test_async_engine_retries_failed_download(mp3spb, monkeypatch):
+    counter = Counter()
+    stub_network(mp3spb, monkeypatch, counter, fail_once=("1.html",))
+    mp3spb.download_songs(songs(3), 0, "", "", 10, 3, "async", 3, 3)
+
+    assert counter.done.count("1.html") == 1
+    assert len(counter.done) == 3
+    assert counter.peak["file"] <= 3
+
+
+def test_async_engine_stops(mp3spb, monkeypatch):
+    counter = Counter()
+    stub_network(mp3spb, monkeypatch, counter)
+    mp3spb.stop_event.set()
+    mp3spb.download_songs(songs(5), 0, "", "", 10, 3, "async", 3, 3)
+
+    assert "page" not in counter.peak
+
+
+def test_async_engine_consumes_jobs_lazily(mp3spb, monkeypatch):
+    counter = Counter()
+    stub_network(mp3spb, monkeypatch, counter)
+    started = []
+
+    def jobs():
+        # the second album is only "fetched" once songs of the first one are being downloaded
+        yield from songs(2)
+        time.sleep(0.1)
+        started.append(len(counter.done))
+        yield ("http://musicmp3spb.org/download/album2.html", "album2")
+
+    mp3spb.download_songs(jobs(), 0, "", "", 10, 3, "async", 3, 3)
+
+    assert started == [2]
+    assert sorted(counter.done) == ["0.html", "1.html", "album2.html"]
@@ -0,0 +1,91 @@
+import http.server
+import threading
+import urllib.error
+
+import pytest
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, body=b"", headers=None):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.connections.add(self.client_address)
+        if self.path == "/redirect":
+            self.reply(302, headers={"Location": "/page?x=1"})
+        elif self.path == "/missing":
+            self.reply(404, b"not found")
+        else:
+            self.reply(200, ("GET %s" % self.path).encode())
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/redirect":
+            self.reply(302, headers={"Location": "/page"})
+        else:
+            self.reply(200, b"POST " + body)
+
+
+@pytest.fixture
+def server():
+    Handler.connections = set()
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_connections_are_reused(mp3spb, server):
+    pool = mp3spb.HTTPConnectionPool(2)
+    for i in range(5):
+        u = pool.request(server + "/page%d" % i, None, None, 5, "", "")
+        assert u.read() == ("GET /page%d" % i).encode()
+        u.close()
+    u = pool.request(server + "/form", b"robot_code=1", None, 5, "", "")
+    assert u.read() == b"POST robot_code=1"
+    u.close()
+    pool.close()
+
+    assert len(Handler.connections) == 1
+
+
+def test_unread_response_is_not_reused(mp3spb, server):
+    pool = mp3spb.HTTPConnectionPool(0)
+    for i in range(3):
+        pool.request(server + "/page", None, None, 5, "", "").close()
+
+    assert len(Handler.connections) == 3
+
+
+def test_redirects(mp3spb, server):
+    pool = mp3spb.HTTPConnectionPool(2)
+    u = pool.request(server + "/redirect", None, None, 5, "", "")
+    assert u.geturl() == server + "/page?x=1"
+    assert u.read() == b"GET /page?x=1"
+    u.close()
+
+    # a redirected POST becomes a GET, like with urllib
+    u = pool.request(server + "/redirect", b"a=1", None, 5, "", "")
+    assert u.read() == b"GET /page"
+    u.close()
+
+
+def test_http_errors(mp3spb, server):
+    pool = mp3spb.HTTPConnectionPool(2)
+    with pytest.raises(urllib.error.HTTPError) as e:
+        pool.request(server + "/missing", None, None, 5, "", "")
+    assert e.value.code == 404
@@ -0,0 +1,61 @@
+import pytest
+
+ALBUM_PAGE = """<html><head><meta charset="utf-8"><title>Carpe Diem</title></head><body>
+<h1><a href="/artist/carpe_diem.html" title="Carpe Diem &amp; Co mp3">Carpe Diem &amp; Co</a></h1>
+<img src="/images/logo.png">
+<img src="/images/cueille_le_jour.jpg">
+<div class="Name">
+Cueille Le Jour<br/>
+<i>1976</i></div>
+<a href="/download/couleurs.html" title="Скачать mp3 Couleurs">Couleurs</a>
+<a href="/download/naissance.html" title="Скачать mp3 Naissance">Naissance</a>
+<a href="/download/couleurs.html">Couleurs</a>
+<a href="/album/en_regardant_passer_le_temps.html">En Regardant Passer Le Temps</a>
+<a href="/album/en_regardant_passer_le_temps.html"><img src="/images/small.gif"></a>
+</body></html>
+"""
+
+SONG_PAGE = """<html><body>
+<form action="/search/" method="get"><input name="q" value=""></form>
+<a href="/file/1234/">01-couleurs.mp3</a>
+<form action="/file/1234/" method="post"><input type="hidden" name="robot_code" value="abcd"></form>
+<a href="http://tempfile.ru/download/1234/01-couleurs.mp3">01-couleurs.mp3</a>
+</body></html>
+"""
+
+
+def parse(mp3spb, content, parser):
+    if parser == "soup":
+        return mp3spb.parse_page_soup(content)
+    page_parser = mp3spb.PageParser()
+    page_parser.feed(content)
+    page_parser.close()
+    page_parser.info.content = content
+    return page_parser.info
+
+
+@pytest.mark.parametrize("parser", ["fast", "soup"])
+def test_album_page(mp3spb, parser):
+    page = parse(mp3spb, ALBUM_PAGE, parser)
+
+    assert (page.artist, page.album, page.year) == ("Carpe Diem & Co", "Cueille Le Jour", "1976")
+    assert mp3spb.find_covers(page) == ["/images/cueille_le_jour.jpg"]
+    assert mp3spb.find_songs_links(page) == ["/download/couleurs.html", "/download/naissance.html"]
+    assert mp3spb.find_albums_links(page) == ["/album/en_regardant_passer_le_temps.html"]
+
+
+@pytest.mark.parametrize("parser", ["fast", "soup"])
+def test_song_page(mp3spb, parser):
+    page = parse(mp3spb, SONG_PAGE, parser)
+
+    assert mp3spb.find_song_form(page) == ("01-couleurs.mp3", "abcd")
+    assert mp3spb.find_file_link(page) == "http://tempfile.ru/download/1234/01-couleurs.mp3"
+
+
+def test_fallback_to_soup(mp3spb):
+    page = parse(mp3spb, ALBUM_PAGE, "fast")
+    # as if the fast parser had missed the links
+    page.links = []
+
+    assert mp3spb.extract(page, mp3spb.find_songs_links) == ["/download/couleurs.html", "/download/naissance.html"]
+    assert mp3spb.extract(page, mp3spb.find_file_link) is None